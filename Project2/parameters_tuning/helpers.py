@@ -96,6 +96,7 @@ def create_csv_submission(predictions):
         else:
             return round(x)
      
-    predictions['Id'] = predictions.apply(lambda x: 'r{}_c{}'.format(int(x.User), int(x.Movie)), axis=1)
+    # build the 'r{User}_c{Movie}' ids column-wise instead of formatting row by row
+    predictions['Id'] = 'r' + predictions.User.astype(int).astype(str) + '_c' + predictions.Movie.astype(int).astype(str)
     predictions['Prediction'] = predictions.Rating.apply(lambda x: round_(x))
     return predictions[['Id', 'Prediction']]
\ No newline at end of file
@@ -2,10 +2,14 @@ import numpy as np
 import scipy
 import scipy.io
 import scipy.sparse as sp
-from itertools import groupby
+import scipy.sparse.linalg
 import pandas as pd
 import os
+from functools import lru_cache
+import numba
+from joblib import Parallel, delayed, effective_n_jobs
 from helpers import *
+from als_kernels import update_factors
 from baseline_helpers import user_habit_standardize, user_habit_standardize_recover
 
 def read_txt(path):
@@ -22,56 +26,30 @@ def load_data(path_dataset):
 
 def preprocess_data(data):
     """preprocessing the text data, conversion to numerical array format."""
-    def deal_line(line):
-        pos, rating = line.split(',')
-        row, col = pos.split("_")
-        row = row.replace("r", "")
-        col = col.replace("c", "")
-        return int(row), int(col), float(rating)
-
-    def statistics(data):
-        row = set([line[0] for line in data])
-        col = set([line[1] for line in data])
-        return min(row), max(row), min(col), max(col)
-
-    # parse each line
-    data = [deal_line(line) for line in data]
+    # parse all 'r{row}_c{col},{rating}' lines at once
+    parsed = pd.Series(data).str.extract(r'r(\d+)_c(\d+),(.+)')
+    rows = parsed[0].astype(np.int64).values
+    cols = parsed[1].astype(np.int64).values
+    values = parsed[2].astype(np.float64).values
 
     # do statistics on the dataset.
-    min_row, max_row, min_col, max_col = statistics(data)
+    max_row, max_col = rows.max(), cols.max()
     print("number of users: {}, number of movies: {}".format(max_row, max_col))
 
     # build rating matrix.
-    ratings = sp.lil_matrix((max_row, max_col))
-    for row, col, rating in data:
-        ratings[row - 1, col - 1] = rating
+    ratings = sp.coo_matrix((values, (rows - 1, cols - 1)), shape=(max_row, max_col)).tocsr()
     return ratings
 
 
-def group_by(data, index):
-    """group list of list by a specific index."""
-    sorted_data = sorted(data, key=lambda x: x[index])
-    groupby_data = groupby(sorted_data, lambda x: x[index])
-    return groupby_data
-
-
 def build_index_groups(train):
     """build groups for nnz rows and cols."""
-    # row : items; cols: users
-    nz_row, nz_col = train.nonzero()
-    nz_train = list(zip(nz_row, nz_col))
-
-    grouped_nz_train_byrow = group_by(nz_train, index=0) # group by items 
-
-    nz_row_colindices = [(g, np.array([v[1] for v in value])) # indices of all the users that rated item g
-                         for g, value in grouped_nz_train_byrow]
-    
-#     print(nz_row_colindices)
-
-    grouped_nz_train_bycol = group_by(nz_train, index=1) # group by users
-    nz_col_rowindices = [(g, np.array([v[0] for v in value])) # indices of all the movies rated by user g
-                         for g, value in grouped_nz_train_bycol]
-    return nz_train, nz_row_colindices, nz_col_rowindices
+    # the movies rated by user u are indices[indptr[u]:indptr[u+1]] of the CSR matrix,
+    # the users who rated movie m are indices[indptr[m]:indptr[m+1]] of the CSC matrix;
+    # the matching ratings are the same slice of data
+    train_csr = train.tocsr()
+    train_csc = train.tocsc()
+    return (train_csr.indptr, train_csr.indices, train_csr.data,
+            train_csc.indptr, train_csc.indices, train_csc.data)
 
 
 def get_number_per(ratings):
@@ -98,28 +76,19 @@ def split_data(ratings, num_users_per_movie, num_movies_per_user,
     
     # init
     num_rows, num_cols = valid_ratings.shape
-    train = sp.lil_matrix((num_rows, num_cols))
-    test = sp.lil_matrix((num_rows, num_cols))
     
     print("the shape of original ratings. (# of row, # of col): {}".format(
         ratings.shape))
     print("the shape of valid ratings. (# of row, # of col): {}".format(
         (num_rows, num_cols)))
-    # get the nonzero entry index of rating matrix
-    nz_users, nz_movies = valid_ratings.nonzero()
+    # get the nonzero entries of rating matrix
+    valid_coo = valid_ratings.tocoo()
+    rows, cols, data = valid_coo.row, valid_coo.col, valid_coo.data
     
-    # split the data
-    for movie in set(nz_movies):
-        # randomly select a subset of ratings
-        row, col = valid_ratings[:, movie].nonzero()
-        selects = np.random.choice(row, size=int(len(row) * p_test))
-        residual = list(set(row) - set(selects))
-
-        # add to train set
-        train[residual, movie] = valid_ratings[residual, movie]
-        if(p_test > 0):
-            # add to test set
-            test[selects, movie] = valid_ratings[selects, movie]
+    # split the data: every rating goes to the test set with probability p_test
+    mask = np.random.rand(valid_coo.nnz) < p_test
+    train = sp.csr_matrix((data[~mask], (rows[~mask], cols[~mask])), shape=(num_rows, num_cols))
+    test = sp.csr_matrix((data[mask], (rows[mask], cols[mask])), shape=(num_rows, num_cols))
     
     
     print("Total number of nonzero elements in origial data:{v}".format(v=ratings.nnz))
@@ -127,139 +96,189 @@ def split_data(ratings, num_users_per_movie, num_movies_per_user,
     print("Total number of nonzero elements in test data:{v}".format(v=test.nnz))
     return valid_ratings, train, test
 
-def init_MF(train, num_features,weight=1.0):
-    """init the parameter for matrix factorization."""
+def init_MF(train, num_features,weight=1.0,init_user=None,init_movie=None,random_state=None):
+    """init the parameter for matrix factorization.
+    init_user / init_movie, if given, are used as starting point instead of random features,
+    random_state (np.random.RandomState) draws the random features, default is the global numpy RNG."""
 
     num_user,num_movie = train.shape
+    rng = np.random if random_state is None else random_state
     # initial the feature matrix
-    movie_features = weight * np.random.rand(num_features,num_movie)
-    user_features = weight * np.random.rand(num_features,num_user)
-    
-    user_nnz = train.getnnz(axis=1)
-    user_sum = train.sum(axis=1)
+    # single precision halves the memory traffic of the updates, Fortran order keeps each
+    # feature vector (column) contiguous
+    if init_movie is not None:
+        movie_features = np.array(init_movie, dtype=np.float32, order='F')
+    else:
+        movie_features = (weight * rng.rand(num_features,num_movie)).astype(np.float32, order='F')
+    if init_user is not None:
+        user_features = np.array(init_user, dtype=np.float32, order='F')
+    else:
+        user_features = (weight * rng.rand(num_features,num_user)).astype(np.float32, order='F')
 
     return movie_features, user_features
 
-def compute_error(data, movie_features, user_features, nz):
-    """compute the loss (RMSE) of the prediction of nonzero elements."""
+def svd_init(train, num_features):
+    """low-rank initialization of the user and movie features from a truncated SVD of train"""
+    # at most min(shape) - 1 singular vectors can be computed by svds
+    if num_features >= min(train.shape):
+        raise ValueError("svd_init needs num_features < {}, got {}".format(min(train.shape), num_features))
+    U, S, Vt = sp.linalg.svds(train.astype(float), k=num_features)
+    # svds does not sort the singular values, keep the largest first
+    order = np.argsort(S)[::-1]
+    sqrt_S = np.sqrt(S[order])
+    init_user = (U[:, order] * sqrt_S).T
+    init_movie = Vt[order] * sqrt_S[:, np.newaxis]
+    return init_user, init_movie
+
+def compute_error(vals, rows, cols, movie_features, user_features):
+    """compute the loss (RMSE) of the prediction of nonzero elements.
+    vals, rows, cols are the COO arrays of the nonzero entries."""
     # calculate rmse (we only consider nonzero entries.)
-    mse = 0
-    for row,col in nz:
-        movie = movie_features[:,col]
-        user = user_features[:,row]
-        mse += ((data[row,col] - movie.T.dot(user))**2)
+    diff = vals - (user_features[:, rows] * movie_features[:, cols]).sum(axis=0)
 
-    rmse = np.sqrt(1.0*mse/len(nz))
+    rmse = np.sqrt(1.0 * (diff @ diff) / diff.size)
     return rmse
 
 def update_movie_feature(
-        train, user_features, lambda_movie,
-        nnz_users_per_movie, nz_movie_userindices):
-    """update movie feature matrix."""
-    """the best lambda is assumed to be nnz_users_per_movie[movie] * lambda_movie"""
+        user_features, diag_add_movie, nz_movie_userindices,
+        movie_features=None, cg_steps=0, sse=None):
+    """update movie feature matrix.
+    the best lambda is assumed to be nnz_users_per_movie[movie] * lambda_movie,
+    diag_add_movie holds this regularization term for every movie.
+    nz_movie_userindices = (indptr, indices, ratings) are the arrays of the CSC training matrix.
+    with cg_steps > 0, the systems are solved by conjugate gradient warm-started from movie_features.
+    if sse is given, sse[movie] receives the squared training error of each movie after the update."""
     # update and return movie feature.
-    num_movies = nnz_users_per_movie.shape[0]
+    indptr, indices, ratings = nz_movie_userindices
+    num_movies = indptr.shape[0] - 1
     num_features = user_features.shape[0]
-    lambda_I = lambda_movie * sp.eye(num_features)
-    updated_movie_features = np.zeros((num_features,num_movies))
-    
-    # update the movie feature matrix one movie by one
-    for movie,user in nz_movie_userindices:
-        M = user_features[:,user]
-        
-        V = M @ train[user,movie]
-        A = M @ M.T + nnz_users_per_movie[movie] * lambda_I
-        Z_star = np.linalg.solve(A,V)
-        updated_movie_features[:,movie] = np.copy(Z_star.T)
+    if cg_steps > 0:
+        updated_movie_features = np.copy(movie_features, order='F')
+    else:
+        updated_movie_features = np.zeros((num_features,num_movies), dtype=np.float32, order='F')
+    if sse is None:
+        sse = np.empty(0)
+    update_factors(indptr, indices, ratings,
+                   user_features, diag_add_movie, updated_movie_features, sse, cg_steps)
     return updated_movie_features
 
 def update_user_feature(
-        train, movie_features, lambda_user,
-        nnz_movies_per_user, nz_user_movieindices):
-    """update user feature matrix."""
-    """the best lambda is assumed to be nnz_users_per_user[user] * lambda_user"""
+        movie_features, diag_add_user, nz_user_movieindices,
+        user_features=None, cg_steps=0, sse=None):
+    """update user feature matrix.
+    the best lambda is assumed to be nnz_users_per_user[user] * lambda_user,
+    diag_add_user holds this regularization term for every user.
+    nz_user_movieindices = (indptr, indices, ratings) are the arrays of the CSR training matrix.
+    with cg_steps > 0, the systems are solved by conjugate gradient warm-started from user_features.
+    if sse is given, sse[user] receives the squared training error of each user after the update."""
     # update and return user feature.
-    num_users = nnz_movies_per_user.shape[0]
+    indptr, indices, ratings = nz_user_movieindices
+    num_users = indptr.shape[0] - 1
     num_features = movie_features.shape[0]
-    lambda_I = lambda_user * sp.eye(num_features)
-    updated_user_features = np.zeros((num_features,num_users))
-    
-    # update the user feature matrix one user by one
-    for user,movie in nz_user_movieindices:
-        M = movie_features[:,movie]
-        
-        V = M @ train[user,movie].T
-        A = M @ M.T + nnz_movies_per_user[user] * lambda_I
-        W_star = np.linalg.solve(A,V)
-        updated_user_features[:,user] = np.copy(W_star.T)
+    if cg_steps > 0:
+        updated_user_features = np.copy(user_features, order='F')
+    else:
+        updated_user_features = np.zeros((num_features,num_users), dtype=np.float32, order='F')
+    if sse is None:
+        sse = np.empty(0)
+    update_factors(indptr, indices, ratings,
+                   movie_features, diag_add_user, updated_user_features, sse, cg_steps)
     return updated_user_features
 
-def ALS(train,num_features,lambda_movie,lambda_user,max_weight=1.0,iterations=50):
+def ALS(train,num_features,lambda_movie,lambda_user,max_weight=1.0,iterations=50,cg_steps=None,
+        init_user=None,init_movie=None,random_state=None):
     """Alternating Least Squares (ALS) algorithm."""
     # define parameters
     stop_criterion = 1e-5
-    change = 1
-    error_list = [0, 0]
+    if cg_steps is None:
+        # for many features, a few warm-started conjugate gradient steps are cheaper than a direct solve
+        cg_steps = 5 if num_features >= 40 else 0
+    prev_rmse = np.inf
     it = 0
  
-    nz_row, nz_col = train.nonzero()
-    nz_train = list(zip(nz_row, nz_col))
-    
 
     # init ALS
-    movie_features, user_features = init_MF(train, num_features,max_weight)
-    
-    # get the number of non-zero ratings for each movie and user
-    nnz_users_per_movie,nnz_movies_per_user = train.getnnz(axis=0),train.getnnz(axis=1)
+    movie_features, user_features = init_MF(train, num_features,max_weight,init_user,init_movie,random_state)
     
     # group the indices by row or column index
-    _, nz_user_movieindices, nz_movie_userindices = build_index_groups(train)
+    user_indptr, user_indices, user_ratings, movie_indptr, movie_indices, movie_ratings = build_index_groups(train)
+    nz_user_movieindices = (user_indptr, user_indices, user_ratings.astype(np.float32))
+    nz_movie_userindices = (movie_indptr, movie_indices, movie_ratings.astype(np.float32))
+    
+    # regularization added to the diagonal of each normal equation: lambda * number of ratings
+    diag_add_user = (lambda_user * np.diff(user_indptr)).astype(np.float32)
+    diag_add_movie = (lambda_movie * np.diff(movie_indptr)).astype(np.float32)
+    # the training error is accumulated per user during the user update
+    user_sse = np.zeros(user_indptr.shape[0] - 1)
     
     train_rmse = 0
     # start ALS
     while(it < iterations):
-        movie_features = update_movie_feature(train, user_features, lambda_movie,
-                            nnz_users_per_movie, nz_movie_userindices)
+        # the training error is only computed every second iteration
+        check_error = (it % 2 == 1)
+        movie_features = update_movie_feature(user_features, diag_add_movie,
+                            nz_movie_userindices, movie_features, cg_steps)
         
-        user_features = update_user_feature(train, movie_features, lambda_user,
-                            nnz_movies_per_user, nz_user_movieindices)
+        user_features = update_user_feature(movie_features, diag_add_user,
+                            nz_user_movieindices, user_features, cg_steps,
+                            user_sse if check_error else None)
         
-        train_rmse = compute_error(train,movie_features,user_features,nz_train)
-#         print("ALS training RMSE : {err}".format(err=train_rmse))
-        error_list.append(train_rmse)
-        change = np.fabs(error_list[-1] - error_list[-2])
-        # if change is small enough then stop
-        if (change < stop_criterion):
-            print("Converge!")
-            break;
+        if check_error:
+            train_rmse = np.sqrt(user_sse.sum() / train.nnz)
+#             print("ALS training RMSE : {err}".format(err=train_rmse))
+            # if the relative change is small enough then stop
+            if (np.fabs(train_rmse - prev_rmse) < stop_criterion * prev_rmse):
+                print("Converge!")
+                break;
+            prev_rmse = train_rmse
         it += 1
         
     print("ALS Final training RMSE : {err}".format(err=train_rmse))
     
     return user_features,movie_features
 
-def cv_ALS_random_search(train,test=None,seed=988):
+def cv_ALS_run(train_tr,test_tr,num_features,lambda_movie,lambda_user,seed,num_threads=None,
+               init_user=None,init_movie=None):
+    """train ALS on one cross-validation fold and return its test RMSE"""
+    # a local RNG keeps the random initialization independent of scheduling
+    # without resetting the caller's global RNG when joblib runs in-process
+    random_state = np.random.RandomState(seed)
+    # warm start from the leading num_features components of the shared initialization
+    if init_user is not None:
+        init_user, init_movie = init_user[:num_features], init_movie[:num_features]
+    # limit the threads of the parallel Numba kernels so that the parallel folds do not oversubscribe the CPU
+    previous_num_threads = numba.get_num_threads()
+    if num_threads is not None:
+        numba.set_num_threads(num_threads)
+    try:
+        user_features,movie_features = ALS(train_tr,num_features,lambda_movie,lambda_user,
+                                           init_user=init_user,init_movie=init_movie,
+                                           random_state=random_state)
+    finally:
+        numba.set_num_threads(previous_num_threads)
+    test_coo = test_tr.tocoo()
+    test_tr_rmse = compute_error(test_coo.data, test_coo.row, test_coo.col, movie_features, user_features)
+    print("RMSE on test data after ALS: {}.".format(test_tr_rmse))
+    return test_tr_rmse
+
+def cv_ALS_random_search(train,test=None,seed=988,n_jobs=-1):
     """random search cross-validation to tune hyper-parameters"""
     
     # randomly generate candidate parameters from appropriate range
     movies_range = np.linspace(0.01,1,num=100)
     user_range = np.linspace(0.01,1,num=100)
     features_num_range = np.linspace(1,60,num=60,dtype=np.int32)
-    weight_range = np.linspace(1.0,3.0,num=60)
     # randomly select 60 parameters to tune 
     # because 60 iterations is enough to reach 0.95 probability to find the optimal
     lambda_movies = np.random.choice(movies_range,60)
     lambda_users = np.random.choice(user_range,60)
     nb_features = np.random.choice(features_num_range,60)
-    weights = np.random.choice(weight_range,60)
     
     # for test
 #     lambda_movies = [0.01]
 #     lambda_users = [0.2]
 #     nb_features = [20]
-#     weights = [1.0]
     
-    best_weight = -1
     best_lambda_user = -1
     best_lambda_movie = -1
     best_num_feature = -1
@@ -271,67 +290,86 @@ def cv_ALS_random_search(train,test=None,seed=988):
     if not os.path.exists(newpath):
         os.makedirs(newpath)
     # initial train data and test data from training dataset for 5-fold cross-validation
-    train_tr_list, test_tr_list = split_for_cv(train,p_test=0.2)
-    for num_features,weight,lambda_movie,lambda_user in zip(nb_features,weights,lambda_movies,lambda_users):
-        rmse_list = []
-        for train_tr,test_tr in zip(train_tr_list, test_tr_list): # 5-fold cv
-            user_features,movie_features = ALS(train_tr,num_features,lambda_movie,lambda_user,weight)
-            nz_row, nz_col = test_tr.nonzero()
-            nz_test = list(zip(nz_row, nz_col))
-            test_tr_rmse = compute_error(test_tr, movie_features, user_features, nz_test)
-            print("RMSE on test data after ALS: {}.".format(test_tr_rmse))  
-#             print("test RMSE: {te_rmse}" .format(te_rmse=test_tr_rmse))
-            rmse_list.append(test_tr_rmse)
+    train_tr_list, test_tr_list = split_for_cv(train,p_test=0.2,k_fold=k_fold)
+    # one low-rank initialization per fold, shared by all candidates so that ALS only has to refine it
+    # (the scale of the features comes from the SVD, so there is no init weight to tune)
+    init_list = [svd_init(train_tr, max(nb_features)) for train_tr in train_tr_list]
+    # every (candidate, fold) ALS run is independent, so run them all in parallel
+    # and split the Numba threads between the joblib workers
+    num_threads = max(1, numba.config.NUMBA_NUM_THREADS // effective_n_jobs(n_jobs))
+    candidates = list(zip(nb_features,lambda_movies,lambda_users))
+    rmses = Parallel(n_jobs=n_jobs)(
+        delayed(cv_ALS_run)(train_tr,test_tr,num_features,lambda_movie,lambda_user,seed + i,
+                            num_threads,init_user,init_movie)
+        for i,(num_features,lambda_movie,lambda_user) in enumerate(candidates)
+        for train_tr,test_tr,(init_user,init_movie) in zip(train_tr_list, test_tr_list, init_list))
+    for i,(num_features,lambda_movie,lambda_user) in enumerate(candidates):
+        rmse_list = rmses[i * k_fold:(i + 1) * k_fold]
         test_rmse = np.mean(rmse_list)
         # save best parameters
         if(test_rmse < best_rmse):
             best_rmse = test_rmse
             bset_lambda_user = lambda_user
             best_lambda_movie = lambda_movie
-            best_weight = weight
             best_num_feature = num_features
             best_rmse = test_rmse
-            print("CHANGE=====>best rmse: {},lambda_user :{},lambda_movie:{},weight:{},num_feature:{}"\
-                  .format(best_rmse,bset_lambda_user,best_lambda_movie,best_weight,best_num_feature))
+            print("CHANGE=====>best rmse: {},lambda_user :{},lambda_movie:{},num_feature:{}"\
+                  .format(best_rmse,bset_lambda_user,best_lambda_movie,best_num_feature))
             
-    print("=======>>>> FINAL: BEST RMSE: {},lambda_user :{},lambda_movie:{},weight:{},num_feature:{}"\
-                              .format(best_rmse,bset_lambda_user,best_lambda_movie,best_weight,best_num_feature))
+    print("=======>>>> FINAL: BEST RMSE: {},lambda_user :{},lambda_movie:{},num_feature:{}"\
+                              .format(best_rmse,bset_lambda_user,best_lambda_movie,best_num_feature))
     
-    best_param = np.array([best_num_feature,best_weight,best_lambda_movie,bset_lambda_user])
+    best_param = np.array([best_num_feature,best_lambda_movie,bset_lambda_user])
 #     np.save("best_param_random_search.npy", best_param)
-    return best_num_feature,best_weight,best_lambda_movie,bset_lambda_user
+    return best_num_feature,best_lambda_movie,bset_lambda_user
 
 def split_for_cv(train,p_test=0.2,k_fold=5):
     """split training data into test data and train data for cv randomly"""
     # init
     num_rows, num_cols = train.shape
-    nz_users, nz_movies = train.nonzero()
+    train_coo = train.tocoo()
+    rows, cols, data = train_coo.row, train_coo.col, train_coo.data
     train_tr_list=[]
     test_tr_list = []
-    # for test
-#     k_fold = 1
+    # one uniform draw per fold and rating: a rating goes to the test set of fold k with probability p_test
+    masks = np.random.rand(k_fold, train_coo.nnz) < p_test
     # split the data
-    for k in range(k_fold):
-        train_tr = sp.lil_matrix((num_rows, num_cols))
-        test_tr = sp.lil_matrix((num_rows, num_cols))
-        for movie in set(nz_movies):
-            # randomly select a subset of ratings
-            row, col = train[:, movie].nonzero()
-            selects = np.random.choice(row, size=int(len(row) * p_test))
-            residual = list(set(row) - set(selects))
-
-            # add to train set
-            train_tr[residual, movie] = train[residual, movie]
-
-            # add to test set
-            test_tr[selects, movie] = train[selects, movie]
-            
+    for mask in masks:
+        train_tr = sp.csr_matrix((data[~mask], (rows[~mask], cols[~mask])), shape=(num_rows, num_cols))
+        test_tr = sp.csr_matrix((data[mask], (rows[mask], cols[mask])), shape=(num_rows, num_cols))
+        
         train_tr_list.append(train_tr)
         test_tr_list.append(test_tr)
         
     return train_tr_list, test_tr_list
 
-def predict_ALS(num_features=None,lambda_movie=None,lambda_user=None,weight=None,load_File=None):
+@lru_cache(maxsize=None)
+def load_sample_pairs(path):
+    """parse the 'r{user}_c{movie}' ids of a submission file once into integer (users, movies) arrays"""
+    sample = pd.read_csv(path)
+    pairs = sample.Id.str.extract(r'r(\d+)_c(\d+)').astype(np.int64)
+    return pairs[0].values, pairs[1].values
+
+def predict_pairs(user_features, movie_features, users, movies, block_size=1024):
+    """predict the ratings of the given (user, movie) pairs (1-based ids) as a (User, Movie, Rating) dataframe"""
+    users, movies = np.asarray(users), np.asarray(movies)
+    # pairs outside of the trained matrix can not be predicted
+    valid = (users >= 1) & (users <= user_features.shape[1]) & (movies >= 1) & (movies <= movie_features.shape[1])
+    users, movies = users[valid], movies[valid]
+    ratings = np.empty(users.shape[0])
+    # predict block_size users at a time so that at most block_size x num_movies predictions are in memory
+    order = np.argsort(users, kind='stable')
+    sorted_users = users[order]
+    for first_user in range(1, user_features.shape[1] + 1, block_size):
+        lo, hi = np.searchsorted(sorted_users, [first_user, first_user + block_size])
+        if lo == hi:
+            continue
+        block_predict = user_features[:, first_user - 1:first_user - 1 + block_size].T @ movie_features
+        idx = order[lo:hi]
+        ratings[idx] = block_predict[users[idx] - first_user, movies[idx] - 1]
+    return pd.DataFrame({"User": users, "Movie": movies, "Rating": ratings})
+
+def predict_ALS(num_features=None,lambda_movie=None,lambda_user=None,load_File=None):
     """just simply use to predict by ALS"""
     seed = 988
     train_dataset = "./data/data_train.csv"
@@ -346,33 +384,21 @@ def predict_ALS(num_features=None,lambda_movie=None,lambda_user=None,weight=None
     
     if(load_File==1):
         best_param = np.load("best_param_random_search.npy")
-        num_features = best_param[0]
-        weight = best_param[1]
-        lambda_movie = best_param[2]
-        lambda_user = best_param[3]
+        # older parameter files also store the init weight at index 1
+        num_features = int(best_param[0])
+        lambda_movie = best_param[-2]
+        lambda_user = best_param[-1]
 #     else:
 #         num_features = 20
-#         weight = 2.18644068
 #         lambda_movie = 0.02
 #         lambda_user = 0.47
-    # ALS
-    user_features,movie_features = ALS(train,num_features,lambda_movie,lambda_user,weight)
-    # predict
-    predict_labels = user_features.T @ movie_features
-    predict = np.asarray(predict_labels.T)
-    # change the matrix into dataframe
-    movie_user_predict = pd.DataFrame(data=predict)
-    movie_user_predict.reset_index(inplace=True)
-    movie_user_predict.rename(columns={"index":"Movie"},inplace=True)
-    movie_user_predict_melt = pd.melt(movie_user_predict,id_vars=["Movie"],var_name="User",value_name ="Rating")
-    movie_user_predict_melt["Movie"] = movie_user_predict_melt["Movie"].values +1
-    movie_user_predict_melt["User"] = movie_user_predict_melt["User"].values +1
-    
-    # match ID in samplesubmission
-    sample = pd.read_csv("./data/sampleSubmission.csv")
-    movie_user_predict_melt['Id'] = movie_user_predict_melt.apply(lambda x: 'r{}_c{}'.format(int(x.User), int(x.Movie)), axis=1)
-    prediction = movie_user_predict_melt[movie_user_predict_melt.Id.isin(sample.Id.values)]
-    prediction = prediction[["User","Movie","Rating"]]
+    # ALS, warm started from the truncated SVD as in the cross-validation
+    init_user,init_movie = svd_init(train,num_features)
+    user_features,movie_features = ALS(train,num_features,lambda_movie,lambda_user,
+                                       init_user=init_user,init_movie=init_movie)
+    # predict only the (user, movie) pairs of samplesubmission
+    sample_users, sample_movies = load_sample_pairs("./data/sampleSubmission.csv")
+    prediction = predict_pairs(user_features, movie_features, sample_users, sample_movies)
     
     return prediction
 
@@ -390,31 +416,29 @@ def run_cross_validation(intest=0,seed=988):
     ratings, num_users_per_movie, num_movies_per_user, min_num_ratings=0, p_test=0.2)
     if(intest ==1):
         num_features = 20
-        weight = 1.0
         lambda_movie = 0.2
         lambda_user = 0.02
     else:
-        num_features,weight,lambda_movie,lambda_user = cv_ALS_random_search(train,test)
-    # ALS    
-    user_features,movie_features = ALS(train,num_features,lambda_movie,lambda_user,weight)
-    nz_row, nz_col = test.nonzero()
-    nz_test = list(zip(nz_row, nz_col))
-    test_rmse = compute_error(test, movie_features, user_features, nz_test)
+        num_features,lambda_movie,lambda_user = cv_ALS_random_search(train,test)
+    # ALS, warm started from the truncated SVD as in the cross-validation
+    init_user,init_movie = svd_init(train,num_features)
+    user_features,movie_features = ALS(train,num_features,lambda_movie,lambda_user,
+                                       init_user=init_user,init_movie=init_movie)
+    test_coo = test.tocoo()
+    test_rmse = compute_error(test_coo.data, test_coo.row, test_coo.col, movie_features, user_features)
     print("RMSE on test data after ALS: {}.".format(test_rmse))
 
 
 def als_algo(train_df,test_df, model):
     """running ALS for blending"""
-    # get users and movies from train_df and test_df
+    # get users, movies and ratings from train_df
     train_users = train_df['User'].values
     train_movies = train_df['Movie'].values
+    train_ratings = train_df['Rating'].values
     # get the number of user and movie to decide the shape of matrix
     num_rows,num_cols = len(train_df['User'].value_counts()),len(train_df['Movie'].value_counts())
-    train = sp.lil_matrix((num_rows, num_cols))
-    test = sp.lil_matrix((num_rows, num_cols))
-    # set value in training data matrix according to training dataframe 
-    for row,col in zip(train_users,train_movies):
-        train[row-1,col-1] = train_df.loc[(train_df['User']==row) &(train_df['Movie']==col),'Rating'].values[0]
+    # build training data matrix from training dataframe
+    train = sp.csr_matrix((train_ratings, (train_users - 1, train_movies - 1)), shape=(num_rows, num_cols))
     
     # use best parameters from tuning
     num_features = 20
@@ -423,23 +447,8 @@ def als_algo(train_df,test_df, model):
     lambda_user = 0.47
     # ALS
     user_features,movie_features = ALS(train,num_features,lambda_movie,lambda_user,weight)
-    # predict
-    predict_labels = user_features.T @ movie_features
-    predict = np.asarray(predict_labels.T)
-    # change data matrix into dataframe
-    movie_user_predict = pd.DataFrame(data=predict)
-    movie_user_predict.reset_index(inplace=True)
-    movie_user_predict.rename(columns={"index":"Movie"},inplace=True)
-    movie_user_predict_melt = pd.melt(movie_user_predict,id_vars=["Movie"],var_name="User",value_name ="Rating")
-    movie_user_predict_melt["Movie"] = movie_user_predict_melt["Movie"].values +1
-    movie_user_predict_melt["User"] = movie_user_predict_melt["User"].values +1
-    
-    # match test_df
-    test_copy = test_df.copy()
-    test_copy['Id'] = test_copy.apply(lambda x: 'r{}_c{}'.format(int(x.User), int(x.Movie)), axis=1)
-    movie_user_predict_melt['Id'] = movie_user_predict_melt.apply(lambda x: 'r{}_c{}'.format(int(x.User), int(x.Movie)), axis=1)
-    prediction = movie_user_predict_melt[movie_user_predict_melt.Id.isin(test_copy.Id.values)]
-    prediction = prediction[["User","Movie","Rating"]]
+    # predict only the (user, movie) pairs of test_df
+    prediction = predict_pairs(user_features, movie_features, test_df['User'].values, test_df['Movie'].values)
     print("[als_algo] prediction: {}".format(prediction.head()))
     return prediction
 
@@ -0,0 +1,140 @@
+import numpy as np
+from numba import njit, prange
+
+
+@njit(fastmath=True, cache=True)
+def gram_dot(Y, cols, reg, v):
+    """compute (M M^T + reg * I) v with M = Y[:, cols] without forming M M^T."""
+    out = v.copy()
+    out *= reg
+    for c in cols:
+        yv = 0.0
+        for f in range(v.shape[0]):
+            yv += Y[f, c] * v[f]
+        for f in range(v.shape[0]):
+            out[f] += yv * Y[f, c]
+    return out
+
+
+@njit(fastmath=True, cache=True)
+def cg_solve(Y, cols, reg, b, x, maxiter=5, tol=1e-4):
+    """solve (M M^T + reg * I) x = b by conjugate gradient, starting from x.
+
+    Every step only costs one product with M and one with M^T, so a few
+    warm-started steps are cheaper than factorizing the matrix when the
+    number of features is large.
+    """
+    r = b - gram_dot(Y, cols, reg, x)
+    p = r.copy()
+    rs = r @ r
+    threshold = (tol * tol) * (b @ b)
+    for it in range(maxiter):
+        if rs <= threshold:
+            break
+        Ap = gram_dot(Y, cols, reg, p)
+        alpha = rs / (p @ Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        rs_new = r @ r
+        p = r + (rs_new / rs) * p
+        rs = rs_new
+    return x
+
+
+@njit(fastmath=True, cache=True)
+def cholesky_solve(A, b):
+    """solve A x = b for a symmetric positive definite A given by its lower triangle.
+
+    A is overwritten by its Cholesky factor L (A = L L^T), the upper triangle is never read.
+    """
+    n = b.shape[0]
+    # factorize A = L L^T in place
+    for j in range(n):
+        s = A[j, j]
+        for k in range(j):
+            s -= A[j, k] * A[j, k]
+        A[j, j] = np.sqrt(s)
+        for i in range(j + 1, n):
+            s = A[i, j]
+            for k in range(j):
+                s -= A[i, k] * A[j, k]
+            A[i, j] = s / A[j, j]
+    # forward substitution L z = b
+    x = b.copy()
+    for i in range(n):
+        s = x[i]
+        for k in range(i):
+            s -= A[i, k] * x[k]
+        x[i] = s / A[i, i]
+    # back substitution L^T x = z
+    for i in range(n - 1, -1, -1):
+        s = x[i]
+        for k in range(i + 1, n):
+            s -= A[k, i] * x[k]
+        x[i] = s / A[i, i]
+    return x
+
+
+@njit(fastmath=True, cache=True)
+def solve_row(Y, cols, ratings, reg):
+    """solve (M M^T + reg * I) x = M r directly, with M = Y[:, cols] and r = ratings."""
+    num_features = Y.shape[0]
+    # accumulate the lower triangle of the (symmetric) Gram matrix and the right hand side
+    # in a single pass over the ratings
+    A = np.zeros((num_features, num_features), dtype=Y.dtype)
+    V = np.zeros(num_features, dtype=Y.dtype)
+    y = np.empty(num_features, dtype=Y.dtype)
+    for k in range(cols.shape[0]):
+        c = cols[k]
+        r = ratings[k]
+        for i in range(num_features):
+            y[i] = Y[i, c]
+        for i in range(num_features):
+            V[i] += r * y[i]
+            for j in range(i + 1):
+                A[i, j] += y[i] * y[j]
+    for f in range(num_features):
+        A[f, f] += reg
+    return cholesky_solve(A, V)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def update_factors(indptr, indices, data, Y, diag_add, out, sse, cg_steps=0):
+    """solve the regularized least squares problem of every row of a CSR/CSC matrix.
+
+    Row u of the sparse matrix (indptr, indices, data) only depends on the fixed
+    factors Y, so all rows are solved independently in parallel:
+        out[:, u] = (M M^T + diag_add[u] * I)^-1 M r,  with M = Y[:, indices_u]
+    Rows without any rating get a zero feature vector.
+    With cg_steps > 0, the system is solved by that many conjugate gradient steps
+    warm-started from the current content of out instead of by a direct solve.
+    If sse is not empty, sse[u] receives the squared training error of row u
+    under the new solution, so no separate pass is needed to compute the RMSE.
+    """
+    num_features = Y.shape[0]
+    num_rows = indptr.shape[0] - 1
+    for u in prange(num_rows):
+        start, end = indptr[u], indptr[u + 1]
+        nnz = end - start
+        if nnz == 0:
+            out[:, u] = 0.0
+            if sse.shape[0] > 0:
+                sse[u] = 0.0
+            continue
+        if cg_steps > 0:
+            V = np.zeros(num_features, dtype=Y.dtype)
+            for k in range(start, end):
+                for f in range(num_features):
+                    V[f] += data[k] * Y[f, indices[k]]
+            x = out[:, u].copy()
+            out[:, u] = cg_solve(Y, indices[start:end], diag_add[u], V, x, cg_steps)
+        else:
+            out[:, u] = solve_row(Y, indices[start:end], data[start:end], diag_add[u])
+        if sse.shape[0] > 0:
+            err = 0.0
+            for k in range(start, end):
+                pred = 0.0
+                for f in range(num_features):
+                    pred += out[f, u] * Y[f, indices[k]]
+                err += (data[k] - pred) ** 2
+            sse[u] = err